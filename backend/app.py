@@ -8,29 +8,45 @@ Início: uvicorn app:app --host 0.0.0.0 --port 8000
 """
 
 import os
-import io
+import asyncio
+import hashlib
+import secrets
+import shutil
+import tempfile
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 from typing import Optional
 
-import chardet
 import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
 from dotenv import load_dotenv
+from cachetools import TTLCache
 from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
+from starlette.formparsers import MultiPartParser
 from supabase import create_client, Client
 
 # Reutiliza as funções do script de ingestão
 from ingestao import (
+    AMOSTRA_ENCODING,
     COLUNAS_MANTER,
     TAMANHO_LOTE,
+    listar_colunas_faltando,
     validar_colunas,
     transformar,
+    converter_valor,
     extrair_mes_ano,
-    deletar_competencia,
-    inserir_em_lotes,
+    valor_dominante,
+    identificar_encoding,
+    ler_tabela,
+    criar_pool,
+    gravar_dados,
     registrar_log,
 )
 
@@ -39,6 +55,15 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# Uploads até este tamanho ficam em memória no SpooledTemporaryFile (sem ir para o disco).
+# O FastAPI não expõe essa opção: no Starlette 0.40/0.41 (fixado pelo fastapi==0.115.6)
+# ela é o atributo de classe MultiPartParser.max_file_size (padrão 1 MB), usado em
+# SpooledTemporaryFile(max_size=...). A alteração vale para o processo inteiro; revisar
+# ao atualizar o FastAPI/Starlette.
+if not hasattr(MultiPartParser, "max_file_size"):
+    raise RuntimeError("MultiPartParser.max_file_size não existe nesta versão do Starlette")
+MultiPartParser.max_file_size = int(os.getenv("UPLOAD_SPOOL_MAX", 32 * 1024 * 1024))
+
 app = FastAPI(title="GratifPanel", version="1.0.0")
 
 app.add_middleware(
@@ -61,7 +86,139 @@ if ALLOWED_USERS_RAW:
 
 
 def get_supabase() -> Client:
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+    """Cliente único criado no startup (reaproveita a sessão HTTP/2 entre requisições)."""
+    return app.state.supabase
+
+
+# Cache em memória para /api/historico e /api/competencias.
+# Os dados só mudam em importações e exclusões, que limpam o cache.
+# Com vários workers cada um tem o seu — por isso o TTL curto.
+CACHE = TTLCache(maxsize=8, ttl=int(os.getenv("CACHE_TTL", 30)))
+
+
+def invalidar_cache():
+    CACHE.pop("historico", None)
+    CACHE.pop("competencias", None)
+
+
+# ─────────────────────────────────────────────
+#  Etapa de CPU (parse + transformação)
+#  Roda em um executor dedicado, fora do event loop.
+#  Threads e não processos: o upload é um arquivo aberto
+#  e os kernels do Arrow liberam o GIL.
+# ─────────────────────────────────────────────
+
+EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
+async def em_executor(funcao, *args):
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, funcao, *args)
+
+
+# CSVs já lidos em /api/validar, aguardando a confirmação em /api/importar.
+# Só as colunas usadas na importação vão para um arquivo Arrow IPC em disco;
+# na memória fica apenas token → (nome do arquivo, momento da validação).
+# Cada token é usado uma única vez.
+PASTA_VALIDADOS = Path(tempfile.mkdtemp(prefix="gratifpanel-"))
+VALIDADOS_TTL   = 600
+VALIDADOS_MAX   = 8
+CSV_VALIDADOS: dict[str, tuple[str, float]] = {}
+
+
+def caminho_validado(token: str) -> Path:
+    return PASTA_VALIDADOS / f"{token}.arrow"
+
+
+def gravar_validado(df: pd.DataFrame, caminho: Path) -> None:
+    tabela = pa.Table.from_pandas(df[COLUNAS_MANTER], preserve_index=False)
+    with ipc.new_file(caminho, tabela.schema) as saida:
+        saida.write_table(tabela)
+
+
+def ler_validado(caminho: Path) -> pd.DataFrame:
+    with ipc.open_file(caminho) as entrada:
+        df = entrada.read_all().to_pandas(types_mapper=pd.ArrowDtype)
+    caminho.unlink(missing_ok=True)
+    return df
+
+
+def expurgar_validados() -> None:
+    """Remove as validações expiradas e as mais antigas além do limite."""
+    limite = time.monotonic() - VALIDADOS_TTL
+    por_idade = sorted(CSV_VALIDADOS, key=lambda t: CSV_VALIDADOS[t][1])
+    excedentes = max(len(por_idade) - VALIDADOS_MAX, 0)
+    for i, token in enumerate(por_idade):
+        if i < excedentes or CSV_VALIDADOS[token][1] < limite:
+            del CSV_VALIDADOS[token]
+            caminho_validado(token).unlink(missing_ok=True)
+
+
+def ler_upload(arquivo: UploadFile) -> tuple[str, pd.DataFrame]:
+    """Detecta o encoding por uma amostra e faz o parse direto do arquivo enviado."""
+    amostra = arquivo.file.read(AMOSTRA_ENCODING)
+    arquivo.file.seek(0)
+    encoding = identificar_encoding(amostra)
+    return encoding, ler_tabela(arquivo.file, encoding)
+
+
+def analisar_csv(arquivo: UploadFile) -> tuple[dict, pd.DataFrame]:
+    """Lê o CSV e calcula as validações e o preview exibidos antes da importação."""
+    encoding, df = ler_upload(arquivo)
+
+    colunas_faltando = listar_colunas_faltando(df)
+
+    # MES_ANO dominante, para checar se já existe no banco
+    mes_ano = valor_dominante(df["MES_ANO"]) if "MES_ANO" in df.columns else None
+    mes_ano = mes_ano.strip() if mes_ano else None
+
+    # Preview das primeiras 5 linhas (colunas selecionadas)
+    colunas_preview = [
+        c for c in [
+            "NUMFUNC", "NUMVINC", "NOME_CARGO", "NOME_ORGAO",
+            "MES_ANO", "COMPETENCIA", "NOME_RUBRICA", "VALOR"
+        ]
+        if c in df.columns
+    ]
+    preview = df[colunas_preview].head(5).fillna("").to_dict(orient="records")
+
+    # Validação de valores
+    # (mesma conversão da importação — conta exatamente o que seria descartado)
+    if "VALOR" in df.columns:
+        valores_invalidos = converter_valor(pa.array(df["VALOR"])).null_count
+    else:
+        valores_invalidos = 0
+
+    analise = {
+        "encoding":          encoding,
+        "colunas_faltando":  colunas_faltando,
+        "total_linhas":      len(df),
+        "mes_ano":           mes_ano,
+        "preview":           preview,
+        "valores_invalidos": int(valores_invalidos),
+    }
+    return analise, df
+
+
+def processar_importacao(df_raw: pd.DataFrame, usuario: str) -> pd.DataFrame:
+    """Valida e transforma o CSV já lido para a importação."""
+    if not validar_colunas(df_raw):
+        raise HTTPException(status_code=400, detail="Estrutura do CSV inválida.")
+
+    return transformar(df_raw, usuario)
+
+
+@app.on_event("startup")
+async def abrir_conexoes():
+    """Cliente Supabase e pool do Postgres reutilizados por todas as requisições."""
+    app.state.supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    app.state.pool     = await criar_pool()
+
+
+@app.on_event("shutdown")
+async def fechar_conexoes():
+    await app.state.pool.close()
+    EXECUTOR.shutdown(wait=False)
+    shutil.rmtree(PASTA_VALIDADOS, ignore_errors=True)
 
 
 # ─────────────────────────────────────────────
@@ -95,10 +252,17 @@ async def login(email: str = Form(...), password: str = Form(...)):
 #  Rota principal — serve o frontend
 # ─────────────────────────────────────────────
 
+# Lido uma única vez; o arquivo só muda a cada deploy
+INDEX_HTML = (Path(__file__).resolve().parent.parent / "frontend" / "index.html").read_bytes()
+INDEX_ETAG = f'"{hashlib.sha1(INDEX_HTML).hexdigest()}"'
+INDEX_HEADERS = {"ETag": INDEX_ETAG, "Cache-Control": "max-age=300"}
+
+
 @app.get("/", response_class=HTMLResponse)
-async def index():
-    with open("../frontend/index.html", "r", encoding="utf-8") as f:
-        return f.read()
+async def index(request: Request):
+    if request.headers.get("if-none-match") == INDEX_ETAG:
+        return Response(status_code=304, headers=INDEX_HEADERS)
+    return HTMLResponse(INDEX_HTML, headers=INDEX_HEADERS)
 
 
 # ─────────────────────────────────────────────
@@ -113,75 +277,41 @@ async def validar_csv(arquivo: UploadFile = File(...)):
     sem gravar nada no banco.
     """
     try:
-        conteudo = await arquivo.read()
-
-        # Detectar encoding
-        resultado = chardet.detect(conteudo[:100_000])
-        encoding  = resultado.get("encoding", "utf-8")
-
-        # Ler CSV
-        try:
-            df = pd.read_csv(
-                io.BytesIO(conteudo),
-                sep=";",
-                encoding=encoding,
-                dtype=str,
-                on_bad_lines="warn",
-            )
-        except Exception:
-            df = pd.read_csv(
-                io.BytesIO(conteudo),
-                sep=";",
-                encoding="latin1",
-                dtype=str,
-                on_bad_lines="warn",
-            )
-
-        # Validações
-        colunas_faltando = [c for c in COLUNAS_MANTER if c not in df.columns]
-        colunas_ok       = len(colunas_faltando) == 0
-        total_linhas     = len(df)
-
-        # Extrai MES_ANO para checar se já existe no banco
-        mes_ano = df["MES_ANO"].mode().iloc[0].strip() if "MES_ANO" in df.columns else None
+        analise, df = await em_executor(analisar_csv, arquivo)
+
+        # Guarda o CSV lido para a importação não precisar reenviar nem reler o arquivo
+        token = None
+        if not analise["colunas_faltando"]:
+            token = secrets.token_urlsafe(16)
+            await em_executor(gravar_validado, df, caminho_validado(token))
+            CSV_VALIDADOS[token] = (arquivo.filename, time.monotonic())
+            expurgar_validados()
+        del df
+
+        mes_ano   = analise["mes_ano"]
         ja_existe = False
 
         if mes_ano:
             supabase   = get_supabase()
             existentes = (
                 supabase.table("gratificacoes")
-                .select("id", count="exact")
+                .select("id")
                 .eq("mes_ano", mes_ano)
+                .limit(1)
                 .execute()
             )
-            ja_existe = (existentes.count or 0) > 0
-
-        # Preview das primeiras 5 linhas (colunas selecionadas)
-        colunas_preview = [
-            c for c in [
-                "NUMFUNC", "NUMVINC", "NOME_CARGO", "NOME_ORGAO",
-                "MES_ANO", "COMPETENCIA", "NOME_RUBRICA", "VALOR"
-            ]
-            if c in df.columns
-        ]
-        preview = df[colunas_preview].head(5).fillna("").to_dict(orient="records")
-
-        # Validação de valores
-        if "VALOR" in df.columns:
-            valores_invalidos = df["VALOR"].str.replace(",", ".", regex=False)
-            valores_invalidos = pd.to_numeric(valores_invalidos, errors="coerce").isna().sum()
-        else:
-            valores_invalidos = 0
+            ja_existe = len(existentes.data) > 0
 
         return JSONResponse({
-            "ok":                colunas_ok,
-            "total_linhas":      total_linhas,
-            "colunas_faltando":  colunas_faltando,
+            "ok":                len(analise["colunas_faltando"]) == 0,
+            "total_linhas":      analise["total_linhas"],
+            "colunas_faltando":  analise["colunas_faltando"],
             "mes_ano":           mes_ano,
             "ja_existe":         ja_existe,
-            "valores_invalidos": int(valores_invalidos),
-            "preview":           preview,
-            "encoding":          encoding,
+            "valores_invalidos": analise["valores_invalidos"],
+            "preview":           analise["preview"],
+            "encoding":          analise["encoding"],
+            "token":             token,
         })
 
     except Exception as e:
@@ -195,55 +325,46 @@ async def validar_csv(arquivo: UploadFile = File(...)):
 
 @app.post("/api/importar")
 async def importar_csv(
-    arquivo:    UploadFile = File(...),
-    usuario:    str        = Form(...),
-    substituir: bool       = Form(False),
+    usuario:    str                  = Form(...),
+    substituir: bool                 = Form(False),
+    token:      Optional[str]        = Form(None),
+    arquivo:    Optional[UploadFile] = File(None),
 ):
     """
-    Recebe o CSV, transforma e grava no Supabase.
-    Se substituir=True, remove os dados do mês antes.
+    Recebe o CSV (ou o token de uma validação recente), transforma e grava no Supabase.
+    Se substituir=True, atualiza os registros do mês e remove os ausentes do arquivo.
     """
     try:
-        conteudo = await arquivo.read()
-        resultado = chardet.detect(conteudo[:100_000])
-        encoding  = resultado.get("encoding", "utf-8")
-
-        try:
-            df_raw = pd.read_csv(
-                io.BytesIO(conteudo),
-                sep=";",
-                encoding=encoding,
-                dtype=str,
-                on_bad_lines="warn",
-            )
-        except Exception:
-            df_raw = pd.read_csv(
-                io.BytesIO(conteudo),
-                sep=";",
-                encoding="latin1",
-                dtype=str,
-                on_bad_lines="warn",
-            )
-
-        if not validar_colunas(df_raw):
-            raise HTTPException(status_code=400, detail="Estrutura do CSV inválida.")
+        if token:
+            expurgar_validados()
+            validado = CSV_VALIDADOS.pop(token, None)
+            if validado is None:
+                raise HTTPException(
+                    status_code=410,
+                    detail="Validação expirada. Envie o arquivo novamente.",
+                )
+            nome_arquivo, _ = validado
+            df_raw = await em_executor(ler_validado, caminho_validado(token))
+        elif arquivo is not None:
+            _, df_raw    = await em_executor(ler_upload, arquivo)
+            nome_arquivo = arquivo.filename
+        else:
+            raise HTTPException(status_code=400, detail="Envie o arquivo ou o token da validação.")
 
-        df      = transformar(df_raw, usuario)
+        df      = await em_executor(processar_importacao, df_raw, usuario)
+        del df_raw
         mes_ano = extrair_mes_ano(df)
         operacao = "SUBSTITUICAO" if substituir else "NOVA"
 
         supabase = get_supabase()
 
-        if substituir:
-            deletar_competencia(supabase, mes_ano)
-
-        inseridos, erros = inserir_em_lotes(supabase, df)
+        inseridos, erros = await gravar_dados(app.state.pool, df, mes_ano, substituir)
 
         registrar_log(
             supabase=supabase,
             mes_ano=mes_ano,
             operacao=operacao,
-            arquivo=arquivo.filename,
+            arquivo=nome_arquivo,
             linhas_total=len(df),
             linhas_inseridas=inseridos,
             linhas_erro=erros,
@@ -263,6 +384,8 @@ async def importar_csv(
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        invalidar_cache()
 
 
 # ─────────────────────────────────────────────
@@ -273,15 +396,18 @@ async def importar_csv(
 async def historico():
     """Retorna as últimas importações registradas."""
     try:
-        supabase = get_supabase()
-        resultado = (
-            supabase.table("importacoes_log")
-            .select("*")
-            .order("importado_em", desc=True)
-            .limit(20)
-            .execute()
-        )
-        return JSONResponse({"ok": True, "dados": resultado.data})
+        dados = CACHE.get("historico")
+        if dados is None:
+            supabase = get_supabase()
+            resultado = (
+                supabase.table("importacoes_log")
+                .select("*")
+                .order("importado_em", desc=True)
+                .limit(20)
+                .execute()
+            )
+            dados = CACHE["historico"] = resultado.data
+        return JSONResponse({"ok": True, "dados": dados})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -290,50 +416,21 @@ async def historico():
 async def listar_competencias():
     """Lista todas as competências (MES_ANO) no banco com contagem de registros."""
     try:
-        supabase = get_supabase()
-        
-        # Busca em páginas de 1000 até pegar tudo
-        all_data = []
-        page_size = 1000
-        offset = 0
-        
-        while True:
-            resultado = (
-                supabase.table("gratificacoes")
-                .select("mes_ano")
-                .range(offset, offset + page_size - 1)
-                .execute()
-            )
-            
-            if not resultado.data:
-                break
-                
-            all_data.extend(resultado.data)
-            
-            # Se retornou menos que page_size, chegamos ao fim
-            if len(resultado.data) < page_size:
-                break
-                
-            offset += page_size
-        
-        # Conta manualmente usando Python
-        from collections import Counter
-        if all_data:
-            counts = Counter([r["mes_ano"] for r in all_data if r.get("mes_ano")])
-            competencias = [
-                {"mes_ano": mes, "total": total} 
-                for mes, total in sorted(counts.items(), reverse=True)
-            ]
-            return JSONResponse({"ok": True, "competencias": competencias})
-        else:
-            return JSONResponse({"ok": True, "competencias": []})
-            
+        competencias = CACHE.get("competencias")
+        if competencias is None:
+            supabase = get_supabase()
+
+            # Agregação feita no banco (função competencia_counts, sql/02_funcoes.sql)
+            resultado = supabase.rpc("competencia_counts").execute()
+            competencias = CACHE["competencias"] = resultado.data or []
+        return JSONResponse({"ok": True, "competencias": competencias})
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/delete-competencia")
-async def deletar_competencia(request: Request):
+async def route_deletar_competencia(request: Request):
     """Deleta todos os registros de uma competência específica."""
     try:
         body = await request.json()
@@ -342,14 +439,12 @@ async def deletar_competencia(request: Request):
         if not mes_ano:
             raise HTTPException(status_code=400, detail="mes_ano não fornecido")
         
-        supabase = get_supabase()
-        resultado = (
-            supabase.table("gratificacoes")
-            .delete()
-            .eq("mes_ano", mes_ano)
-            .execute()
+        # Direto pelo pool: o status "DELETE n" já traz a contagem, sem devolver as linhas
+        status = await app.state.pool.execute(
+            "DELETE FROM gratificacoes WHERE mes_ano = $1", mes_ano
         )
-        return JSONResponse({"ok": True, "deleted": len(resultado.data) if resultado.data else 0})
+        invalidar_cache()
+        return JSONResponse({"ok": True, "deleted": int(status.split()[-1])})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
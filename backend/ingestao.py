@@ -2,20 +2,30 @@
 GratifPanel — Script de Ingestão
 =================================
 Lê o CSV mensal da gratificação de desempenho,
-aplica transformações e envia ao Supabase.
+aplica transformações e envia ao Supabase
+(dados via COPY direto no Postgres; log via API).
 
 Uso:
     python ingestao.py --arquivo pagamento_fev_2025.csv --usuario "joao.silva"
     python ingestao.py --arquivo pagamento_fev_2025.csv --usuario "joao.silva" --substituir
 """
 
+import io
 import os
 import sys
 import argparse
+import asyncio
+import codecs
 import hashlib
-import chardet
+import asyncpg
+import cchardet
+import numpy as np
 import pandas as pd
-from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pacsv
+from datetime import datetime, timezone
+from numba import njit
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
@@ -28,6 +38,9 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# Conexão direta ao Postgres (usada no COPY binário da tabela gratificacoes)
+DATABASE_URL = os.getenv("DATABASE_URL")
+
 # Colunas que serão MANTIDAS do CSV original
 COLUNAS_MANTER = [
     "EMP_CODIGO",
@@ -50,56 +63,189 @@ COLUNAS_MANTER = [
     "VDA",
     "VALOR",
 ]
+COLUNAS_MANTER_SET = frozenset(COLUNAS_MANTER)
+
+# Colunas da tabela gratificacoes, na ordem enviada pelo COPY
+COLUNAS_BANCO = [
+    "cod",
+    "emp_codigo",
+    "mes_ano",
+    "num_folha",
+    "setor",
+    "orgao",
+    "situacao",
+    "cargo",
+    "tipovinc",
+    "rubrica",
+    "nome_rubrica",
+    "complemento",
+    "competencia",
+    "info",
+    "tipo_pagamento",
+    "tipo_rubrica",
+    "vda",
+    "valor",
+    "importado_em",
+    "importado_por",
+]
 
-# Tamanho dos lotes de inserção (evita timeout)
-TAMANHO_LOTE = 500
+# Chave de unicidade da tabela (constraint uq_registro em sql/01_criar_tabela.sql)
+CHAVE_REGISTRO = ["cod", "rubrica", "competencia", "mes_ano", "num_folha"]
+
+# Cada lote entra numa tabela temporária (descartada no fim da transação)
+# e de lá vai para gratificacoes, deixando o Postgres resolver duplicidades
+COLUNAS_SQL = ", ".join(COLUNAS_BANCO)
+SQL_CRIAR_LOTE = (
+    f"CREATE TEMP TABLE lote_gratificacoes ON COMMIT DROP AS "
+    f"SELECT {COLUNAS_SQL} FROM gratificacoes WITH NO DATA"
+)
+SQL_INSERIR = (
+    f"INSERT INTO gratificacoes ({COLUNAS_SQL}) "
+    f"SELECT {COLUNAS_SQL} FROM lote_gratificacoes "
+    f"ON CONFLICT ON CONSTRAINT uq_registro DO NOTHING"
+)
+SQL_ATUALIZAR = (
+    f"INSERT INTO gratificacoes ({COLUNAS_SQL}) "
+    f"SELECT {COLUNAS_SQL} FROM lote_gratificacoes "
+    f"ON CONFLICT ON CONSTRAINT uq_registro DO UPDATE SET "
+    + ", ".join(f"{c} = EXCLUDED.{c}" for c in COLUNAS_BANCO if c not in CHAVE_REGISTRO)
+)
+
+# Bytes lidos do início do arquivo para detectar o encoding
+AMOSTRA_ENCODING = 32_768
+
+# Tamanho dos lotes de inserção (evita timeout) — ajustável via INGEST_BATCH
+TAMANHO_LOTE = int(os.getenv("INGEST_BATCH", 5000))
 
 
 # ─────────────────────────────────────────────
 #  Funções auxiliares
 # ─────────────────────────────────────────────
 
+def identificar_encoding(conteudo: bytes) -> str:
+    """
+    Identifica o encoding por uma amostra do início do arquivo.
+    Testa UTF-8 e CP1252 (os casos comuns) antes de recorrer ao cchardet.
+    Usa a amostra inteira: um cabeçalho só com ASCII passa em UTF-8 mesmo
+    em arquivos Latin1; se o primeiro acento vier depois, o ler_tabela cai
+    no Latin1 ao encontrar o byte inválido.
+    """
+    if conteudo.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+
+    amostra = conteudo[:AMOSTRA_ENCODING]
+
+    # Bytes nulos indicam UTF-16/32 — deixa para o cchardet
+    if b"\x00" not in amostra:
+        for encoding in ("utf-8", "cp1252"):
+            try:
+                # Decodificador incremental: não falha num caractere cortado no fim da amostra
+                codecs.getincrementaldecoder(encoding)().decode(amostra, final=False)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+
+    resultado = cchardet.detect(conteudo[:AMOSTRA_ENCODING])
+    return resultado.get("encoding") or "latin1"
+
+
 def detectar_encoding(caminho_arquivo: str) -> str:
     """Detecta automaticamente o encoding do arquivo."""
     with open(caminho_arquivo, "rb") as f:
-        resultado = chardet.detect(f.read(100_000))
-    encoding = resultado.get("encoding", "utf-8")
-    print(f"  → Encoding detectado: {encoding} (confiança: {resultado.get('confidence', 0):.0%})")
+        encoding = identificar_encoding(f.read(AMOSTRA_ENCODING))
+    print(f"  → Encoding detectado: {encoding}")
     return encoding
 
 
-def ler_csv(caminho_arquivo: str) -> pd.DataFrame:
-    """Lê o CSV com detecção automática de encoding."""
-    print("\n📂 Lendo arquivo CSV...")
-    encoding = detectar_encoding(caminho_arquivo)
+def avisar_linha_invalida(linha) -> str:
+    """Avisa sobre linhas com campos a mais e as descarta (equivale ao on_bad_lines="warn")."""
+    # o leitor multi-thread não informa o número da linha, só o texto
+    print(f"  ⚠ Linha ignorada: {linha.text[:80]}")
+    return "skip"
+
+
+def tabela_para_pandas(tabela: pa.Table) -> pd.DataFrame:
+    """
+    Converte todas as colunas para texto antes de ir ao pandas: colunas vazias
+    (tipo null) e colunas com bytes fora do UTF-8 (tipo binary) quebrariam o
+    preview; o cast de binary falha e dispara o fallback para Latin1.
+    """
+    tabela = tabela.cast(pa.schema([pa.field(c, pa.string()) for c in tabela.column_names]))
+    # Mantém as strings no formato Arrow para as operações .str do transformar
+    return tabela.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def ler_tabela(origem, encoding: str) -> pd.DataFrame:
+    """
+    Faz o parse do CSV com o leitor multi-thread do pyarrow.
+    Aceita caminho, conteúdo em bytes ou arquivo aberto; tenta Latin1 como fallback.
+    Se houver linhas com campos a menos, refaz a leitura com o pandas, que as
+    completa com nulos como antes.
+    """
+    def parse(enc: str) -> pd.DataFrame:
+        fonte = io.BytesIO(origem) if isinstance(origem, bytes) else origem
+        if hasattr(fonte, "seek"):
+            fonte.seek(0)
+
+        linhas_curtas = []
+
+        def tratar_linha_invalida(linha) -> str:
+            if linha.actual_columns > linha.expected_columns:
+                return avisar_linha_invalida(linha)
+            linhas_curtas.append(linha.text)
+            return "skip"
+
+        tabela = pacsv.read_csv(
+            fonte,
+            read_options=pacsv.ReadOptions(encoding=enc),
+            parse_options=pacsv.ParseOptions(
+                delimiter=";",
+                invalid_row_handler=tratar_linha_invalida,
+            ),
+            convert_options=pacsv.ConvertOptions(
+                # lê as colunas obrigatórias como texto; vazio vira nulo
+                column_types={c: pa.string() for c in COLUNAS_MANTER},
+                strings_can_be_null=True,
+            ),
+        )
+        if not linhas_curtas:
+            return tabela_para_pandas(tabela)
+
+        print(f"  → {len(linhas_curtas)} linha(s) com campos a menos; relendo com o pandas...")
+        del tabela
+        if hasattr(fonte, "seek"):
+            fonte.seek(0)
+        df = pd.read_csv(fonte, sep=";", encoding=enc, dtype=str, on_bad_lines="warn")
+        return tabela_para_pandas(pa.Table.from_pandas(df, preserve_index=False))
 
     try:
-        df = pd.read_csv(
-            caminho_arquivo,
-            sep=";",
-            encoding=encoding,
-            dtype=str,           # lê tudo como texto primeiro
-            on_bad_lines="warn", # avisa sobre linhas problemáticas
-        )
+        return parse(encoding)
     except Exception:
-        # Tenta Latin1 como fallback
         print("  → Tentando encoding Latin1 como fallback...")
-        df = pd.read_csv(
-            caminho_arquivo,
-            sep=";",
-            encoding="latin1",
-            dtype=str,
-            on_bad_lines="warn",
-        )
+        return parse("latin1")
 
+
+def ler_csv(caminho_arquivo: str) -> pd.DataFrame:
+    """Lê o CSV com detecção automática de encoding."""
+    print("\n📂 Lendo arquivo CSV...")
+    encoding = detectar_encoding(caminho_arquivo)
+    df = ler_tabela(caminho_arquivo, encoding)
     print(f"  → {len(df):,} linhas e {len(df.columns)} colunas encontradas")
     return df
 
 
+def listar_colunas_faltando(df: pd.DataFrame) -> list[str]:
+    """Colunas obrigatórias ausentes do arquivo, na ordem de COLUNAS_MANTER."""
+    presentes = set(df.columns)
+    if COLUNAS_MANTER_SET <= presentes:
+        return []
+    return [c for c in COLUNAS_MANTER if c not in presentes]
+
+
 def validar_colunas(df: pd.DataFrame) -> bool:
     """Verifica se as colunas obrigatórias existem no arquivo."""
     print("\n🔍 Validando estrutura do arquivo...")
-    faltando = [c for c in COLUNAS_MANTER if c not in df.columns]
+    faltando = listar_colunas_faltando(df)
 
     if faltando:
         print(f"  ✗ ERRO — Colunas obrigatórias ausentes: {faltando}")
@@ -109,28 +255,122 @@ def validar_colunas(df: pd.DataFrame) -> bool:
     return True
 
 
+# Estados devolvidos por ler_valores_brl
+VALOR_OK, VALOR_INVALIDO, VALOR_LONGO = 0, 1, 2
+
+
+@njit(cache=True, nogil=True)
+def ler_valores_brl(dados, offsets, nulos, saida, estado):
+    """
+    Converte os textos de VALOR direto dos buffers do Arrow, numa única passada.
+    Mesmas regras da limpeza por regex: descarta o que não for dígito, "," "." ou "-";
+    aceita um único separador decimal e o sinal só no início.
+    """
+    for i in range(len(saida)):
+        estado[i] = VALOR_INVALIDO
+        if nulos[i]:
+            continue
+
+        mantissa = 0
+        digitos = 0
+        casas = 0
+        separador = False
+        negativo = False
+        inicio = True
+        valido = True
+
+        for j in range(offsets[i], offsets[i + 1]):
+            c = dados[j]
+            if 48 <= c <= 57:              # dígito
+                if digitos < 18:
+                    mantissa = mantissa * 10 + (c - 48)
+                digitos += 1
+                if separador:
+                    casas += 1
+                inicio = False
+            elif c == 44 or c == 46:       # "," ou "."
+                if separador:
+                    valido = False
+                    break
+                separador = True
+                inicio = False
+            elif c == 45:                  # "-"
+                if not inicio:
+                    valido = False
+                    break
+                negativo = True
+                inicio = False
+
+        if not valido or digitos == 0:
+            continue
+
+        # Acima de 15 dígitos a divisão abaixo pode perder precisão
+        if digitos > 15:
+            estado[i] = VALOR_LONGO
+            continue
+
+        valor = mantissa / 10.0 ** casas
+        saida[i] = -valor if negativo else valor
+        estado[i] = VALOR_OK
+
+
+def converter_texto_valor(valor: pa.Array) -> pa.Array:
+    """Conversão por regex do Arrow — usada para os valores longos demais para o kernel."""
+    valor = pc.replace_substring(valor, ",", ".")
+    valor = pc.replace_substring_regex(valor, r"[^\d.\-]", "")  # remove caracteres estranhos
+    # o que não for um número bem formado vira nulo (equivale ao errors="coerce")
+    valido = pc.match_substring_regex(valor, r"^-?(\d+\.?\d*|\.\d+)$")
+    return pc.cast(pc.if_else(valido, valor, None), pa.float64())
+
+
+def converter_valor(valor: pa.Array) -> pa.Array:
+    """Converte a coluna VALOR (texto) para float64; inválidos viram nulo."""
+    if isinstance(valor, pa.ChunkedArray):
+        valor = valor.combine_chunks()
+    valor = valor.cast(pa.large_string())
+
+    _, buf_offsets, buf_dados = valor.buffers()
+    offsets = np.frombuffer(buf_offsets, dtype=np.int64)[valor.offset : valor.offset + len(valor) + 1]
+    dados   = np.frombuffer(buf_dados, dtype=np.uint8) if buf_dados is not None else np.zeros(0, np.uint8)
+    nulos   = valor.is_null().to_numpy(zero_copy_only=False)
+
+    saida  = np.zeros(len(valor), dtype=np.float64)
+    estado = np.empty(len(valor), dtype=np.int8)
+    ler_valores_brl(dados, offsets, nulos, saida, estado)
+
+    longos = np.flatnonzero(estado == VALOR_LONGO)
+    if len(longos):
+        convertidos = converter_texto_valor(valor.take(longos))
+        saida[longos]  = convertidos.fill_null(0).to_numpy(zero_copy_only=False)
+        estado[longos] = np.where(convertidos.is_null().to_numpy(zero_copy_only=False),
+                                  VALOR_INVALIDO, VALOR_OK)
+
+    return pa.array(saida, mask=estado != VALOR_OK)
+
+
 def transformar(df: pd.DataFrame, usuario: str) -> pd.DataFrame:
     """Aplica todas as transformações necessárias."""
     print("\n⚙️  Transformando dados...")
 
-    # 1. Manter apenas as colunas necessárias
-    df = df[COLUNAS_MANTER].copy()
+    # 1. Manter apenas as colunas necessárias — novo frame sobre os mesmos
+    #    arrays (sem .copy(); as etapas abaixo substituem colunas, não as alteram)
+    df = pd.DataFrame({col: df[col].array for col in COLUNAS_MANTER}, copy=False)
 
-    # 2. Limpar espaços em branco em todas as colunas de texto
-    for col in df.select_dtypes(include="object").columns:
-        df[col] = df[col].str.strip()
+    # 2. Limpar espaços em branco em todas as colunas (kernels do Arrow;
+    #    o ler_tabela já lê todas as COLUNAS_MANTER como texto)
+    for col in COLUNAS_MANTER:
+        df[col] = pd.arrays.ArrowExtensionArray(pc.utf8_trim_whitespace(pa.array(df[col])))
 
-    # 3. Criar coluna COD (NUMFUNC + NUMVINC concatenados)
-    df["cod"] = df["NUMFUNC"].fillna("") + df["NUMVINC"].fillna("")
-    df["cod"] = df["cod"].str.strip()
-
-    # 4. Converter VALOR: trocar vírgula por ponto e converter para número
-    df["VALOR"] = (
-        df["VALOR"]
-        .str.replace(",", ".", regex=False)
-        .str.replace(r"[^\d.\-]", "", regex=True)  # remove caracteres estranhos
+    # 3. Criar coluna COD (NUMFUNC + NUMVINC concatenados; nulo entra como "")
+    df["cod"] = pd.arrays.ArrowExtensionArray(
+        pc.binary_join_element_wise(
+            pa.array(df["NUMFUNC"]), pa.array(df["NUMVINC"]), "",
+            null_handling="replace",
+        )
     )
-    df["VALOR"] = pd.to_numeric(df["VALOR"], errors="coerce")
+
+    # 4. Converter VALOR para número (vírgula ou ponto como separador decimal)
+    df["VALOR"] = pd.arrays.ArrowExtensionArray(converter_valor(pa.array(df["VALOR"])))
 
     # 5. Remover linhas sem COD ou sem VALOR válido
     antes = len(df)
@@ -166,54 +406,156 @@ def transformar(df: pd.DataFrame, usuario: str) -> pd.DataFrame:
 
     # 8. Adicionar metadados de importação
     df["importado_por"] = usuario
-    df["importado_em"]  = datetime.now().isoformat()
-
-    # 9. Substituir NaN por None (compatível com JSON/Supabase)
-    df = df.where(pd.notnull(df), None)
+    df["importado_em"]  = datetime.now(timezone.utc)
 
     print(f"  ✓ {len(df):,} linhas prontas para importação")
     return df
 
 
+def valor_dominante(serie: pd.Series):
+    """Valor mais frequente da coluna (None se vazia), sem a ordenação do .mode()."""
+    serie = serie.dropna()
+    if serie.empty:
+        return None
+
+    # Caso comum: o arquivo inteiro é de uma única competência
+    primeiro = serie.iloc[0]
+    if (serie == primeiro).all():
+        return primeiro
+    return serie.value_counts(sort=False).idxmax()
+
+
 def extrair_mes_ano(df: pd.DataFrame) -> str:
     """Extrai o MES_ANO dominante do arquivo para usar no log."""
     if "mes_ano" in df.columns:
-        return df["mes_ano"].mode().iloc[0] if not df["mes_ano"].empty else "DESCONHECIDO"
+        return valor_dominante(df["mes_ano"]) or "DESCONHECIDO"
     return "DESCONHECIDO"
 
 
-def deletar_competencia(supabase: Client, mes_ano: str) -> int:
-    """Remove todos os registros de um MES_ANO para reprocessamento."""
-    print(f"\n🗑️  Removendo registros existentes de {mes_ano}...")
-    resultado = supabase.table("gratificacoes").delete().eq("mes_ano", mes_ano).execute()
-    total = len(resultado.data) if resultado.data else 0
+async def criar_pool() -> asyncpg.Pool:
+    """Abre o pool de conexões diretas ao Postgres."""
+    return await asyncpg.create_pool(DATABASE_URL, min_size=2, max_size=10)
+
+
+def remover_repetidos(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mantém só a última ocorrência de cada chave do uq_registro no arquivo.
+    Os lotes rodam em paralelo: uma chave repetida em lotes diferentes daria
+    resultado dependente da ordem de chegada (ou deadlock entre os lotes).
+    Linhas com alguma coluna da chave nula nunca conflitam e ficam todas.
+    """
+    chave_nula = df[CHAVE_REGISTRO].isna().any(axis=1)
+    repetida = df.duplicated(subset=CHAVE_REGISTRO, keep="last") & ~chave_nula
+    return df[~repetida]
+
+
+async def inserir_em_lotes(
+    pool: asyncpg.Pool, df: pd.DataFrame, substituir: bool = False
+) -> tuple[int, int]:
+    """
+    Insere os dados em lotes paralelos para evitar timeout.
+    Cada lote vai por COPY binário para uma tabela temporária e daí para
+    gratificacoes com ON CONFLICT: linhas já existentes são ignoradas
+    ou, se substituir=True, atualizadas.
+    Retorna (gravados, erros); na substituição, gravados inclui os atualizados.
+    """
+    print(f"\n📤 Enviando dados ao Postgres em lotes de {TAMANHO_LOTE}...")
+    unicos = remover_repetidos(df)
+    repetidos = len(df) - len(unicos)
+    total = len(unicos)
+    gravados = 0
+    erros = 0
+    enviados = 0
+
+    # Arrow na ordem do COPY; nulos viram None no to_pylist
+    tabela = pa.Table.from_pandas(unicos[COLUNAS_BANCO], preserve_index=False)
+    del unicos
+
+    # Um lote em voo por conexão do pool
+    limite = asyncio.Semaphore(pool.get_max_size())
+
+    async def enviar(i: int) -> int:
+        nonlocal enviados
+        async with limite:
+            # Materializa só o lote atual (a fatia do Arrow não copia dados)
+            fatia = tabela.slice(i, TAMANHO_LOTE)
+            lote = list(zip(*(coluna.to_pylist() for coluna in fatia.columns)))
+            async with pool.acquire() as conn, conn.transaction():
+                await conn.execute(SQL_CRIAR_LOTE)
+                await conn.copy_records_to_table(
+                    "lote_gratificacoes", records=lote, columns=COLUNAS_BANCO
+                )
+                status = await conn.execute(SQL_ATUALIZAR if substituir else SQL_INSERIR)
+            enviados += len(lote)
+            print(f"  → {enviados:,} / {total:,} registros enviados...", end="\r")
+            return int(status.split()[-1])  # "INSERT 0 <linhas inseridas ou atualizadas>"
+
+    inicios = range(0, total, TAMANHO_LOTE)
+    resultados = await asyncio.gather(*[enviar(i) for i in inicios], return_exceptions=True)
+
+    for i, resultado in zip(inicios, resultados):
+        progresso = min(i + TAMANHO_LOTE, total)
+        if isinstance(resultado, Exception):
+            erros += progresso - i
+            print(f"\n  ⚠ Erro no lote {i}–{progresso}: {resultado}")
+        else:
+            gravados += resultado
+
+    if substituir:
+        resumo = f"{gravados:,} gravados (novos ou atualizados), {erros:,} erros"
+    else:
+        ignorados = total - gravados - erros
+        resumo = (f"{gravados:,} inseridos, {erros:,} erros"
+                  + (f", {ignorados:,} já existentes ignorados" if ignorados else ""))
+    if repetidos:
+        resumo += f", {repetidos:,} repetidos no arquivo (vale a última ocorrência)"
+    print(f"\n  ✓ Concluído: {resumo}")
+    return gravados, erros
+
+
+async def remover_obsoletos(pool: asyncpg.Pool, df: pd.DataFrame, mes_ano: str) -> int:
+    """
+    Na substituição, remove as linhas do MES_ANO que não vieram no novo arquivo:
+    as demais acabaram de ser gravadas e têm exatamente o importado_em desta
+    importação. A comparação é por igualdade, não pelo relógio: não depende da
+    hora da máquina que gravou antes e também leva linhas com importado_em nulo.
+    """
+    if df.empty:
+        return 0
+    importado_em = df["importado_em"].iloc[0].to_pydatetime()
+
+    print(f"\n🗑️  Removendo registros de {mes_ano} ausentes do novo arquivo...")
+    status = await pool.execute(
+        "DELETE FROM gratificacoes WHERE mes_ano = $1 AND importado_em IS DISTINCT FROM $2",
+        mes_ano, importado_em,
+    )
+    total = int(status.split()[-1])  # "DELETE <linhas>"
     print(f"  ✓ {total:,} registros removidos")
     return total
 
 
-def inserir_em_lotes(supabase: Client, df: pd.DataFrame) -> tuple[int, int]:
-    """Insere os dados em lotes para evitar timeout."""
-    print(f"\n📤 Enviando dados ao Supabase em lotes de {TAMANHO_LOTE}...")
-    total = len(df)
-    inseridos = 0
-    erros = 0
+async def gravar_dados(
+    pool: asyncpg.Pool, df: pd.DataFrame, mes_ano: str, substituir: bool
+) -> tuple[int, int]:
+    """Grava os lotes e, na substituição sem erros, limpa o que sobrou do arquivo anterior."""
+    inseridos, erros = await inserir_em_lotes(pool, df, substituir)
 
-    registros = df.to_dict(orient="records")
+    if substituir:
+        if erros:
+            print("\n  ⚠ Houve lotes com erro — registros antigos do mês foram mantidos")
+        else:
+            await remover_obsoletos(pool, df, mes_ano)
 
-    for i in range(0, total, TAMANHO_LOTE):
-        lote = registros[i : i + TAMANHO_LOTE]
-        progresso = min(i + TAMANHO_LOTE, total)
+    return inseridos, erros
 
-        try:
-            supabase.table("gratificacoes").insert(lote).execute()
-            inseridos += len(lote)
-            print(f"  → {progresso:,} / {total:,} registros enviados...", end="\r")
-        except Exception as e:
-            erros += len(lote)
-            print(f"\n  ⚠ Erro no lote {i}–{progresso}: {e}")
 
-    print(f"\n  ✓ Concluído: {inseridos:,} inseridos, {erros:,} erros")
-    return inseridos, erros
+async def enviar_dados(df: pd.DataFrame, mes_ano: str, substituir: bool) -> tuple[int, int]:
+    """Abre um pool só para esta execução (uso via linha de comando)."""
+    pool = await criar_pool()
+    try:
+        return await gravar_dados(pool, df, mes_ano, substituir)
+    finally:
+        await pool.close()
 
 
 def registrar_log(
@@ -235,8 +577,8 @@ def registrar_log(
         "linhas_inseridas": linhas_inseridas,
         "linhas_erro":      linhas_erro,
         "importado_por":    usuario,
-        "importado_em":     datetime.now().isoformat(),
-    }).execute()
+        "importado_em":     datetime.now(timezone.utc).isoformat(),
+    }, returning="minimal").execute()
 
 
 # ─────────────────────────────────────────────
@@ -269,8 +611,8 @@ def main():
         print(f"\n✗ Arquivo não encontrado: {args.arquivo}")
         sys.exit(1)
 
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        print("\n✗ Variáveis SUPABASE_URL e SUPABASE_KEY não configuradas no .env")
+    if not SUPABASE_URL or not SUPABASE_KEY or not DATABASE_URL:
+        print("\n✗ Variáveis SUPABASE_URL, SUPABASE_KEY e DATABASE_URL não configuradas no .env")
         sys.exit(1)
 
     print("\n" + "═" * 50)
@@ -296,6 +638,7 @@ def main():
         sys.exit(1)
 
     df = transformar(df_raw, args.usuario)
+    del df_raw
     mes_ano = extrair_mes_ano(df)
     operacao = "SUBSTITUICAO" if args.substituir else "NOVA"
 
@@ -303,15 +646,14 @@ def main():
 
     # ── Confirmar substituição
     if args.substituir:
-        print(f"\n⚠️  ATENÇÃO: Todos os registros de {mes_ano} serão removidos antes da importação.")
+        print(f"\n⚠️  ATENÇÃO: Todos os registros de {mes_ano} serão substituídos pelos do arquivo.")
         confirmacao = input("  Digite SIM para confirmar: ").strip().upper()
         if confirmacao != "SIM":
             print("  Operação cancelada.")
             sys.exit(0)
-        deletar_competencia(supabase, mes_ano)
 
     # ── Inserir dados
-    inseridos, erros = inserir_em_lotes(supabase, df)
+    inseridos, erros = asyncio.run(enviar_dados(df, mes_ano, args.substituir))
 
     # ── Registrar log
     registrar_log(
@@ -331,7 +673,7 @@ def main():
     print("═" * 50)
     print(f"  MES_ANO   : {mes_ano}")
     print(f"  Total     : {len(df):,} linhas processadas")
-    print(f"  Inseridos : {inseridos:,}")
+    print(f"  Gravados  : {inseridos:,}")
     print(f"  Erros     : {erros:,}")
     print(f"  Operação  : {operacao}")
     print("═" * 50 + "\n")
@@ -0,0 +1,124 @@
+"""
+Fixtures dos testes da API.
+Supabase e pool do asyncpg são substituídos por dublês em memória:
+os testes não precisam de rede nem de banco.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as modulo_app  # noqa: E402
+
+
+class ResultadoFalso:
+    def __init__(self, data=None):
+        self.data  = data or []
+        self.count = len(self.data)
+
+
+class ConsultaFalsa:
+    """Aceita qualquer cadeia select/eq/insert/... e registra as chamadas."""
+
+    def __init__(self, tabela: str, chamadas: list):
+        self.tabela   = tabela
+        self.chamadas = chamadas
+
+    def __getattr__(self, nome):
+        def metodo(*args, **kwargs):
+            self.chamadas.append((self.tabela, nome, args, kwargs))
+            return self
+        return metodo
+
+    def execute(self):
+        return ResultadoFalso()
+
+
+class SupabaseFalso:
+    def __init__(self):
+        self.chamadas = []
+
+    def table(self, nome: str):
+        return ConsultaFalsa(nome, self.chamadas)
+
+    def rpc(self, nome: str, params=None):
+        return ConsultaFalsa(nome, self.chamadas)
+
+
+class TransacaoFalsa:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class ConexaoFalsa:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def transaction(self):
+        return TransacaoFalsa()
+
+    async def execute(self, sql: str, *args):
+        self.pool.sql.append(sql)
+        if sql.startswith("INSERT"):
+            return f"INSERT 0 {self.pool.ultimo_lote}"
+        return "CREATE TABLE"
+
+    async def copy_records_to_table(self, tabela: str, records, columns):
+        registros = list(records)
+        self.pool.copiados.extend(registros)
+        self.pool.ultimo_lote = len(registros)
+
+
+class AquisicaoFalsa:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return ConexaoFalsa(self.pool)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class PoolFalso:
+    """Imita o que o ingestao usa do asyncpg.Pool, guardando o SQL executado."""
+
+    def __init__(self):
+        self.sql         = []
+        self.copiados    = []
+        self.ultimo_lote = 0
+
+    def get_max_size(self) -> int:
+        return 2
+
+    def acquire(self):
+        return AquisicaoFalsa(self)
+
+    async def execute(self, sql: str, *args):
+        self.sql.append(sql)
+        return "DELETE 0"
+
+
+@pytest.fixture
+def supabase():
+    return SupabaseFalso()
+
+
+@pytest.fixture
+def pool():
+    return PoolFalso()
+
+
+@pytest.fixture
+def cliente(supabase, pool):
+    # Sem o "with": os eventos de startup/shutdown (conexões reais) não rodam
+    modulo_app.app.state.supabase = supabase
+    modulo_app.app.state.pool     = pool
+    return TestClient(modulo_app.app)
@@ -0,0 +1,54 @@
+"""
+Testes da rota de importação com Supabase e banco simulados.
+"""
+
+from ingestao import SQL_ATUALIZAR, SQL_INSERIR
+
+CABECALHO = (
+    "EMP_CODIGO;MES_ANO;NUM_FOLHA;SETOR;ORGAO;NUMFUNC;NUMVINC;SITUACAO;CARGO;TIPOVINC;"
+    "RUBRICA;NOME_RUBRICA;COMPLEMENTO;COMPETENCIA;INFO;TIPO_PAGAMENTO;TIPO_RUBRICA;VDA;"
+    "VALOR;NOME_CARGO;NOME_ORGAO"
+)
+LINHAS = [
+    "1;02/2025;1;SETOR;ORG;1001;1;ATIVO;C1;T;R1;Gratificação;;01/02/2025;;N;P;V;1234,56;Técnico;Secretaria",
+    "1;02/2025;1;SETOR;ORG;1002;1;ATIVO;C1;T;R1;Gratificação;;01/02/2025;;N;P;V;99,90;Técnico;Secretaria",
+    "1;02/2025;1;SETOR;ORG;1003;2;ATIVO;C2;T;R1;Gratificação;;01/02/2025;;N;P;V;abc;Analista;Secretaria",
+]
+CSV = ("\n".join([CABECALHO, *LINHAS]) + "\n").encode("cp1252")
+
+
+def importar(cliente, substituir: bool):
+    return cliente.post(
+        "/api/importar",
+        data={"usuario": "teste", "substituir": str(substituir).lower()},
+        files={"arquivo": ("folha.csv", CSV, "text/csv")},
+    )
+
+
+def test_importar_com_substituicao(cliente, supabase, pool):
+    """substituir=True faz o upsert e remove os registros antigos do mês."""
+    resposta = importar(cliente, substituir=True)
+
+    assert resposta.status_code == 200, resposta.text
+    corpo = resposta.json()
+    assert corpo["operacao"]  == "SUBSTITUICAO"
+    assert corpo["mes_ano"]   == "02/2025"
+    assert corpo["inseridos"] == 2          # a linha com VALOR "abc" é descartada
+    assert corpo["erros"]     == 0
+
+    assert SQL_ATUALIZAR in pool.sql
+    assert SQL_INSERIR not in pool.sql
+    assert any(sql.startswith("DELETE FROM gratificacoes") for sql in pool.sql)
+
+    logs = [c for c in supabase.chamadas if c[0] == "importacoes_log" and c[1] == "insert"]
+    assert logs and logs[0][2][0]["operacao"] == "SUBSTITUICAO"
+
+
+def test_importar_sem_substituicao(cliente, pool):
+    """Importação nova só insere: nada é atualizado nem removido."""
+    resposta = importar(cliente, substituir=False)
+
+    assert resposta.status_code == 200, resposta.text
+    assert resposta.json()["operacao"] == "NOVA"
+    assert SQL_INSERIR in pool.sql
+    assert not any(sql.startswith("DELETE") for sql in pool.sql)
@@ -0,0 +1,23 @@
+-- ============================================================
+--  GratifPanel — Funções usadas pela API
+--  Execute este script no SQL Editor do Supabase
+--  (depois do 01_criar_tabela.sql)
+-- ============================================================
+
+-- ============================================================
+--  Contagem de registros por competência (MES_ANO)
+--  Chamada via RPC pela rota /api/competencias — a agregação
+--  acontece no banco em vez de trafegar a coluna inteira
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION competencia_counts()
+RETURNS TABLE (mes_ano TEXT, total BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT g.mes_ano, COUNT(*) AS total
+    FROM gratificacoes g
+    WHERE g.mes_ano IS NOT NULL
+    GROUP BY g.mes_ano
+    ORDER BY g.mes_ano DESC
+$$;